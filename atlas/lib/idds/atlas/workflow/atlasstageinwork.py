@@ -8,10 +8,14 @@
 # Authors:
 # - Wen Guan, <wen.guan@cern.ch>, 2020
 
-import copy
+import collections
+import threading
+import time
 import traceback
 import uuid
 
+from concurrent import futures
+
 from rucio.client.client import Client as RucioClient
 from rucio.common.exception import (CannotAuthenticate as RucioCannotAuthenticate,
                                     DuplicateRule as RucioDuplicateRule,
@@ -23,13 +27,39 @@ from idds.common.constants import (TransformType, CollectionStatus, ContentStatu
 from idds.workflow.work import Work
 
 
+# rucio clients are not thread safe, every polling thread keeps its own one.
+# the polling threads are kept alive between polls, so that their clients are reused.
+_thread_data = threading.local()
+_poll_executor = None
+_poll_executor_lock = threading.Lock()
+
+# metadata of closed collections will not change anymore, it's cached to avoid polling DDM again.
+DID_METADATA_CACHE_TTL = 300
+_did_metadata_cache = {}
+_did_metadata_cache_lock = threading.Lock()
+
+
+def get_poll_executor(num_threads):
+    """
+    Get the thread pool shared by the collection polls. It's created at the first poll.
+
+    :param num_threads: The number of threads of the pool if it's not created yet.
+    """
+    global _poll_executor
+    with _poll_executor_lock:
+        if _poll_executor is None:
+            _poll_executor = futures.ThreadPoolExecutor(max_workers=num_threads)
+        return _poll_executor
+
+
 class ATLASStageinWork(Work):
     def __init__(self, executable=None, arguments=None, parameters=None, setup=None,
                  work_tag='stagein', exec_type='local', sandbox=None, work_id=None,
                  primary_input_collection=None, other_input_collections=None,
                  output_collections=None, log_collections=None,
                  workflow=None, logger=None,
-                 max_waiting_time=3600 * 7 * 24, src_rse=None, dest_rse=None, rule_id=None):
+                 max_waiting_time=3600 * 7 * 24, src_rse=None, dest_rse=None, rule_id=None,
+                 num_poll_threads=5):
         """
         Init a work/task/transformation.
 
@@ -49,6 +79,7 @@ class ATLASStageinWork(Work):
         :param src_rse: The source rse.
         :param dest_rse: The destination rse.
         :param rule_id: The rule id.
+        :param num_poll_threads: The max number of threads to poll collections from DDM concurrently.
         """
         super(ATLASStageinWork, self).__init__(executable=executable, arguments=arguments,
                                                parameters=parameters, setup=setup, work_type=TransformType.StageIn,
@@ -64,70 +95,163 @@ class ATLASStageinWork(Work):
         self.dest_rse = dest_rse
         self.life_time = max_waiting_time
         self.rule_id = rule_id
+        self.num_poll_threads = num_poll_threads
+        # the next map id, to avoid scanning all mapped ids in every poll.
+        self._next_map_key = None
 
     def get_rucio_client(self):
-        try:
-            client = RucioClient()
-        except RucioCannotAuthenticate as error:
-            self.logger.error(error)
-            self.logger.error(traceback.format_exc())
-            raise exceptions.IDDSException('%s: %s' % (str(error), traceback.format_exc()))
+        client = getattr(_thread_data, 'rucio_client', None)
+        if client is None:
+            try:
+                client = RucioClient()
+            except RucioCannotAuthenticate as error:
+                self.logger.error(error)
+                self.logger.error(traceback.format_exc())
+                raise exceptions.IDDSException('%s: %s' % (str(error), traceback.format_exc()))
+            _thread_data.rucio_client = client
         return client
 
+    def is_open_collection(self, coll):
+        if 'coll_metadata' in coll and 'is_open' in coll['coll_metadata'] and not coll['coll_metadata']['is_open']:
+            return False
+        return True
+
+    def get_collection_from_did_metadata(self, did_meta):
+        meta = {'scope': did_meta['scope'],
+                'name': did_meta['name'],
+                'coll_metadata': {
+                    'bytes': did_meta['bytes'],
+                    'total_files': did_meta['length'],
+                    'availability': did_meta['availability'],
+                    'events': did_meta['events'],
+                    'is_open': did_meta['is_open'],
+                    'run_number': did_meta['run_number'],
+                    'did_type': did_meta['did_type'],
+                    'list_all_files': False}
+                }
+        return meta
+
+    def get_cached_did_metadata(self, scope, name):
+        key = '%s:%s' % (scope, name)
+        with _did_metadata_cache_lock:
+            if key in _did_metadata_cache:
+                expired_at, did_meta = _did_metadata_cache[key]
+                if expired_at > time.time():
+                    return did_meta
+                del _did_metadata_cache[key]
+        return None
+
+    def cache_did_metadata(self, did_meta):
+        if did_meta['is_open']:
+            return
+        key = '%s:%s' % (did_meta['scope'], did_meta['name'])
+        with _did_metadata_cache_lock:
+            _did_metadata_cache[key] = (time.time() + DID_METADATA_CACHE_TTL, did_meta)
+
+    def invalidate_cached_did_metadata(self, colls):
+        with _did_metadata_cache_lock:
+            for coll in colls:
+                _did_metadata_cache.pop('%s:%s' % (coll['scope'], coll['name']), None)
+
     def poll_external_collection(self, coll):
         try:
-            if 'coll_metadata' in coll and 'is_open' in coll['coll_metadata'] and not coll['coll_metadata']['is_open']:
+            if not self.is_open_collection(coll):
                 return coll
             else:
-                meta = {}
-                did_meta = self.client.get_metadata(scope=coll['scope'], name=coll['name'])
-                meta = {'scope': coll['scope'],
-                        'name': coll['name'],
-                        'coll_metadata': {
-                            'bytes': did_meta['bytes'],
-                            'total_files': did_meta['length'],
-                            'availability': did_meta['availability'],
-                            'events': did_meta['events'],
-                            'is_open': did_meta['is_open'],
-                            'run_number': did_meta['run_number'],
-                            'did_type': did_meta['did_type'],
-                            'list_all_files': False}
-                        }
-                return meta
+                did_meta = self.get_cached_did_metadata(coll['scope'], coll['name'])
+                if did_meta is None:
+                    rucio_client = self.get_rucio_client()
+                    did_meta = rucio_client.get_metadata(scope=coll['scope'], name=coll['name'])
+                    did_meta['scope'], did_meta['name'] = coll['scope'], coll['name']
+                    self.cache_did_metadata(did_meta)
+                return self.get_collection_from_did_metadata(did_meta)
         except Exception as ex:
+            self.invalidate_cached_did_metadata([coll])
             self.logger.error(ex)
             self.logger.error(traceback.format_exc())
             raise exceptions.IDDSException('%s: %s' % (str(ex), traceback.format_exc()))
 
+    def poll_external_collections_one_by_one(self, colls):
+        ret = {}
+        executor = get_poll_executor(max(1, self.num_poll_threads))
+        polls = [executor.submit(self.poll_external_collection, coll) for coll in colls]
+        for poll in futures.as_completed(polls):
+            coll = poll.result()
+            ret['%s:%s' % (coll['scope'], coll['name'])] = coll
+        return ret
+
+    def poll_external_collections(self, colls):
+        """
+        Poll the metadata of collections from DDM with one bulk request.
+        If the DDM does not support the bulk request, collections are polled one by one concurrently.
+
+        :param colls: List of collections.
+
+        :returns: dict of polled collections with 'scope:name' as the key.
+        """
+        ret = {}
+        open_colls = []
+        for coll in colls:
+            if not self.is_open_collection(coll):
+                ret['%s:%s' % (coll['scope'], coll['name'])] = coll
+                continue
+            did_meta = self.get_cached_did_metadata(coll['scope'], coll['name'])
+            if did_meta is None:
+                open_colls.append(coll)
+            else:
+                ret['%s:%s' % (coll['scope'], coll['name'])] = self.get_collection_from_did_metadata(did_meta)
+        if not open_colls:
+            return ret
+
+        try:
+            rucio_client = self.get_rucio_client()
+            dids = [{'scope': coll['scope'], 'name': coll['name']} for coll in open_colls]
+            for did_meta in rucio_client.get_metadata_bulk(dids=dids):
+                self.cache_did_metadata(did_meta)
+                ret['%s:%s' % (did_meta['scope'], did_meta['name'])] = self.get_collection_from_did_metadata(did_meta)
+        except exceptions.IDDSException:
+            raise
+        except Exception as ex:
+            self.invalidate_cached_did_metadata(open_colls)
+            self.logger.warn("Failed to get metadata in bulk, polling collections one by one: %s" % str(ex))
+            ret.update(self.poll_external_collections_one_by_one(open_colls))
+            return ret
+
+        # the bulk request silently skips the dids it cannot find, they are polled one by one to report the error.
+        missing_colls = [coll for coll in open_colls if '%s:%s' % (coll['scope'], coll['name']) not in ret]
+        if missing_colls:
+            ret.update(self.poll_external_collections_one_by_one(missing_colls))
+        return ret
+
     def get_input_collections(self):
         # return [self.primary_input_collection] + self.other_input_collections
         colls = [self.primary_input_collection] + self.other_input_collections
+        colls_map = self.collections
+        polled_colls = self.poll_external_collections([colls_map[coll_int_id] for coll_int_id in colls])
         for coll_int_id in colls:
-            coll = self.collections[coll_int_id]
-            coll = self.poll_external_collection(coll)
-            self.collections[coll_int_id] = coll
-        return super(self).get_input_collections()
+            coll = colls_map[coll_int_id]
+            colls_map[coll_int_id] = polled_colls['%s:%s' % (coll['scope'], coll['name'])]
+        return super(ATLASStageinWork, self).get_input_collections()
 
     def get_input_contents(self):
         """
         Get all input contents from DDM.
         """
         try:
-            ret_files = []
             rucio_client = self.get_rucio_client()
-            files = rucio_client.list_files(scope=self.collections[self.primary_input_collection]['scope'],
-                                            name=self.collections[self.primary_input_collection]['name'])
-            for file in files:
-                ret_file = {'coll_id': self.collections[self.primary_input_collection]['coll_id'],
-                            'scope': file['scope'],
-                            'name': file['name'],
-                            'bytes': file['bytes'],
-                            'adler32': file['adler32'],
-                            'min_id': 0,
-                            'max_id': file['events'],
-                            'content_type': ContentType.File,
-                            'content_metadata': {'events': file['events']}}
-                ret_files.append(ret_file)
+            primary_input = self.collections[self.primary_input_collection]
+            coll_id = primary_input['coll_id']
+            content_type = ContentType.File
+            files = rucio_client.list_files(scope=primary_input['scope'], name=primary_input['name'])
+            ret_files = [{'coll_id': coll_id,
+                          'scope': file['scope'],
+                          'name': file['name'],
+                          'bytes': file['bytes'],
+                          'adler32': file['adler32'],
+                          'min_id': 0,
+                          'max_id': file['events'],
+                          'content_type': content_type,
+                          'content_metadata': {'events': file['events']}} for file in files]
             return ret_files
         except Exception as ex:
             self.logger.error(ex)
@@ -140,10 +264,7 @@ class ATLASStageinWork(Work):
             inputs = mapped_input_output_maps[map_id]['inputs']
 
             # if 'primary' is not set, the first one is the primary input.
-            primary_input = inputs[0]
-            for ip in inputs:
-                if 'primary' in ip['content_metadata'] and ip['content_metadata']['primary']:
-                    primary_input = ip
+            primary_input = next((ip for ip in inputs if ip.get('content_metadata', {}).get('primary')), inputs[0])
             ret.append(primary_input)
         return ret
 
@@ -155,7 +276,7 @@ class ATLASStageinWork(Work):
         """
         inputs = self.get_input_contents()
         mapped_inputs = self.get_mapped_inputs(mapped_input_output_maps)
-        mapped_inputs_scope_name = [ip['scope'] + ":" + ip['name'] for ip in mapped_inputs]
+        mapped_inputs_scope_name = {ip['scope'] + ":" + ip['name'] for ip in mapped_inputs}
 
         new_inputs = []
         new_input_output_maps = {}
@@ -168,17 +289,21 @@ class ATLASStageinWork(Work):
         if not new_inputs and self.collections[self.primary_input_collection]['status'] in [CollectionStatus.Closed]:
             self.set_has_new_inputs(False)
         else:
-            mapped_keys = mapped_input_output_maps.keys()
-            if mapped_keys:
-                next_key = max(mapped_keys) + 1
-            else:
-                next_key = 1
+            next_key = self._next_map_key
+            if next_key is None or next_key in mapped_input_output_maps:
+                mapped_keys = mapped_input_output_maps.keys()
+                if mapped_keys:
+                    next_key = max(mapped_keys) + 1
+                else:
+                    next_key = 1
+            output_coll_id = self.collections[self.output_collections[0]]['coll_id']
             for ip in new_inputs:
-                out_ip = copy.deepcopy(ip)
-                out_ip['coll_id'] = self.collections[self.output_collections[0]]['coll_id']
+                # inputs are flat dicts, only content_metadata needs to be copied.
+                out_ip = dict(ip, coll_id=output_coll_id, content_metadata=dict(ip['content_metadata']))
                 new_input_output_maps[next_key] = {'inputs': [ip],
                                                    'outputs': [out_ip]}
                 next_key += 1
+            self._next_map_key = next_key
 
         return new_input_output_maps
 
@@ -206,7 +331,7 @@ class ATLASStageinWork(Work):
                                                         copies=1,
                                                         rse_expression=self.dest_rse,
                                                         source_replica_expression=self.src_rse,
-                                                        lifetime=self.lifetime,
+                                                        lifetime=self.life_time,
                                                         locked=False,
                                                         grouping='DATASET',
                                                         ask_approval=False)
@@ -215,10 +340,12 @@ class ATLASStageinWork(Work):
             return rule_id
         except RucioDuplicateRule as ex:
             self.logger.warn(ex)
-            rules = rucio_client.list_did_rules(scope=self.primary_input_collection['scope'], name=self.primary_input_collection['name'])
-            for rule in rules:
-                if rule['account'] == rucio_client.account and rule['rse_expression'] == self.dest_rse:
-                    return rule['id']
+            # rucio cannot filter rules on the server side, stop at the first matched one.
+            account = rucio_client.account
+            rules = rucio_client.list_did_rules(scope=ds_did['scope'], name=ds_did['name'])
+            matched_rule = next((rule for rule in rules if rule['account'] == account and rule['rse_expression'] == self.dest_rse), None)
+            if matched_rule:
+                return matched_rule['id']
         except Exception as ex:
             self.logger.error(ex)
             self.logger.error(traceback.format_exc())
@@ -245,11 +372,10 @@ class ATLASStageinWork(Work):
 
             replicases_status = {}
             if rule['locks_ok_cnt'] > 0:
+                # rucio cannot filter locks by state, only the 'OK' ones are kept here.
                 locks = rucio_client.list_replica_locks(rule_id=rule_id)
-                for lock in locks:
-                    scope_name = '%s:%s' % (lock['scope'], lock['name'])
-                    if lock['state'] == 'OK':
-                        replicases_status[scope_name] = ContentStatus.Available   # 'OK'
+                replicases_status = {'%s:%s' % (lock['scope'], lock['name']): ContentStatus.Available
+                                     for lock in locks if lock['state'] == 'OK'}
             return p, rule['state'], replicases_status
         except RucioRuleNotFound as ex:
             msg = "rule(%s) not found: %s" % (str(rule_id), str(ex))
@@ -261,22 +387,23 @@ class ATLASStageinWork(Work):
     def poll_processing_updates(self, input_output_maps):
         processing, rule_state, rep_status = self.poll_processing()
 
-        updated_contents = []
-        content_substatus = {'finished': 0, 'unfinished': 0}
+        # index outputs once, then only the ones reported by the rule are checked.
+        output_index = {}
         for map_id in input_output_maps:
-            outputs = input_output_maps[map_id]['outputs']
-            for content in outputs:
-                key = '%s:%s' % (content['scope'], content['name'])
-                if key in rep_status:
-                    if content['substatus'] != rep_status[key]['substatus']:
-                        updated_content = {'content_id': content['content_id'],
-                                           'substatus': rep_status[key]['substatus']}
-                        updated_contents.append(updated_content)
-                        content['substatus'] = rep_status[key]['substatus']
-                if content['substatus'] == ContentStatus.Available:
-                    content_substatus['finished'] += 1
-                else:
-                    content_substatus['unfinished'] += 1
+            for content in input_output_maps[map_id]['outputs']:
+                output_index.setdefault('%s:%s' % (content['scope'], content['name']), []).append(content)
+
+        updated_contents = []
+        for key, substatus in rep_status.items():
+            for content in output_index.get(key, []):
+                if content['substatus'] != substatus:
+                    updated_content = {'content_id': content['content_id'],
+                                       'substatus': substatus}
+                    updated_contents.append(updated_content)
+                    content['substatus'] = substatus
+
+        content_substatus = collections.Counter('finished' if content['substatus'] == ContentStatus.Available else 'unfinished'
+                                                for contents in output_index.values() for content in contents)
 
         update_processing = {}
         if rule_state == 'OK' and content_substatus['finished'] > 0 and content_substatus['unfinished'] == 0:
@@ -285,14 +412,10 @@ class ATLASStageinWork(Work):
         return update_processing, updated_contents
 
     def get_status_statistics(self, registered_input_output_maps):
-        status_statistics = {}
-        for map_id in registered_input_output_maps:
-            outputs = registered_input_output_maps['map_id']['outputs']
-
-            for content in outputs:
-                if content['status'].name not in status_statistics:
-                    status_statistics[content['status'].name] = 0
-                status_statistics[content['status'].name] += 1
+        status_statistics = collections.Counter(content['status'].name
+                                                for map_id in registered_input_output_maps
+                                                for content in registered_input_output_maps[map_id]['outputs'])
+        status_statistics = dict(status_statistics)
         self.status_statistics = status_statistics
         return status_statistics
 
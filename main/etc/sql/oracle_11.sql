@@ -62,6 +62,7 @@ CREATE OR REPLACE TRIGGER TRIG_REQUEST_ID
 CREATE INDEX REQUESTS_SCOPE_NAME_IDX ON REQUESTS (name, scope, workload_id) LOCAL;
 --- drop index REQUESTS_STATUS_PRIORITY_IDX
 CREATE INDEX REQUESTS_STATUS_PRIORITY_IDX ON REQUESTS (status, priority, request_id, locking, updated_at, next_poll_at, created_at) LOCAL COMPRESS 1;
+CREATE INDEX REQUESTS_WORKLOAD_ID_IDX ON REQUESTS (workload_id, request_id);
 
 
 --- workprogress
@@ -135,10 +136,12 @@ PARTITION BY RANGE(TRANSFORM_ID)
 INTERVAL ( 100000 )
 ( PARTITION initial_part VALUES LESS THAN (1) );
 
+--- transform ids can be taken from the sequence before the insert, for bulk inserts. The trigger keeps them.
 CREATE OR REPLACE TRIGGER TRIG_TRANSFORM_ID
     BEFORE INSERT
     ON TRANSFORMS
     FOR EACH ROW
+    WHEN (NEW.transform_id IS NULL)
     BEGIN
         :NEW.transform_id := TRANSFORM_ID_SEQ.NEXTVAL ;
     END;
@@ -162,6 +165,8 @@ PARTITION BY RANGE(REQUEST_ID)
 INTERVAL ( 100000 )
 ( PARTITION initial_part VALUES LESS THAN (1) );
 
+CREATE INDEX REQ2TRANSFORM_TRANS_ID_IDX ON REQ2TRANSFORMS (transform_id, request_id);
+
 
 --- req2workload
 CREATE TABLE REQ2WORKLOAD
@@ -238,6 +243,8 @@ CREATE OR REPLACE TRIGGER TRIG_PROCESSING_ID
  /
 
 CREATE INDEX PROCESSINGS_STATUS_UPDATED_IDX ON PROCESSINGS (status, locking, updated_at, next_poll_at, created_at) LOCAL;
+CREATE INDEX PROCESSINGS_STATUS_POLL_IDX ON PROCESSINGS (status, next_poll_at, locking) LOCAL;
+CREATE INDEX PROCESSINGS_LOCKING_IDX ON PROCESSINGS (locking, updated_at) LOCAL;
 
 
 --- collections
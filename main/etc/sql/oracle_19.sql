@@ -52,6 +52,7 @@ INTERVAL ( 100000 )
 CREATE INDEX REQUESTS_SCOPE_NAME_IDX ON REQUESTS (name, scope, workload_id) LOCAL;
 --- drop index REQUESTS_STATUS_PRIORITY_IDX
 CREATE INDEX REQUESTS_STATUS_PRIORITY_IDX ON REQUESTS (status, priority, request_id, locking, updated_at, next_poll_at, created_at) LOCAL COMPRESS 1;
+CREATE INDEX REQUESTS_WORKLOAD_ID_IDX ON REQUESTS (workload_id, request_id);
 
 
 --- workprogress
@@ -131,6 +132,8 @@ CREATE TABLE REQ2TRANSFORMS
 PCTFREE 0
 COMPRESS FOR OLTP;
 
+CREATE INDEX REQ2TRANSFORM_TRANS_ID_IDX ON REQ2TRANSFORMS (transform_id, request_id);
+
 --- req2workload
 CREATE TABLE REQ2WORKLOAD
 (
@@ -184,6 +187,8 @@ PCTFREE 0
 PARTITION BY REFERENCE(PROCESSINGS_TRANSFORM_ID_FK);
 
 CREATE INDEX PROCESSINGS_STATUS_UPDATED_AT_IDX ON PROCESSINGS (status, locking, updated_at, next_poll_at, created_at) LOCAL;
+CREATE INDEX PROCESSINGS_STATUS_POLL_IDX ON PROCESSINGS (status, next_poll_at, locking) LOCAL;
+CREATE INDEX PROCESSINGS_LOCKING_IDX ON PROCESSINGS (locking, updated_at) LOCAL;
 
 
 --- collections
@@ -10,6 +10,7 @@
 
 import datetime
 import traceback
+from concurrent import futures
 try:
     # python 3
     from queue import Queue
@@ -43,6 +44,8 @@ class Carrier(BaseAgent):
         self.new_output_queue = Queue()
         self.running_task_queue = Queue()
         self.running_output_queue = Queue()
+        self.running_processings_future = None
+        self.prefetch_executor = futures.ThreadPoolExecutor(max_workers=1)
 
     def init(self):
         status = [ProcessingStatus.New, ProcessingStatus.Submitting, ProcessingStatus.Submitted,
@@ -54,7 +57,8 @@ class Carrier(BaseAgent):
         Get new processing
         """
         processing_status = [ProcessingStatus.New]
-        processings = core_processings.get_processings_by_status(status=processing_status, locking=True, bulk_size=self.retrieve_bulk_size)
+        processings = core_processings.get_processings_by_status(status=processing_status, locking=True, bulk_size=self.retrieve_bulk_size,
+                                                                 deferred_columns=['output_metadata'])
 
         self.logger.debug("Main thread get %s [new] processings to process" % len(processings))
         if processings:
@@ -85,26 +89,37 @@ class Carrier(BaseAgent):
         return ret
 
     def finish_new_processings(self):
+        processings = []
         while not self.new_output_queue.empty():
             processing = self.new_output_queue.get()
             self.logger.info("Main thread submitted new processing: %s" % (processing['processing_id']))
-            processing_id = processing['processing_id']
             if 'next_poll_at' not in processing:
                 processing['next_poll_at'] = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.poll_time_period)
-            del processing['processing_id']
             processing['locking'] = ProcessingLocking.Idle
             # self.logger.debug("wen: %s" % str(processing))
-            core_processings.update_processing(processing_id=processing_id, parameters=processing)
+            processings.append(processing)
+        if processings:
+            core_processings.update_processings(parameters=processings)
 
     def get_running_processings(self):
         """
         Get running processing
         """
         processing_status = [ProcessingStatus.Submitting, ProcessingStatus.Submitted, ProcessingStatus.Running, ProcessingStatus.FinishedOnExec]
-        processings = core_processings.get_processings_by_status(status=processing_status,
-                                                                 # time_period=self.poll_time_period,
-                                                                 locking=True,
-                                                                 bulk_size=self.retrieve_bulk_size)
+        # the ids of the next batch are prefetched without locking, so nothing stays locked if the agent stops.
+        # they are claimed when the batch is consumed, which skips the ones claimed or polled by others meanwhile.
+        future, self.running_processings_future = self.running_processings_future, None
+        if future is None:
+            processing_ids = core_processings.get_processing_ids_by_status(status=processing_status,
+                                                                           bulk_size=self.retrieve_bulk_size)
+        else:
+            processing_ids = future.result()
+        processings = core_processings.claim_processings(processing_ids, status=processing_status,
+                                                         deferred_columns=['output_metadata'])
+        if not self.graceful_stop.is_set():
+            self.running_processings_future = self.prefetch_executor.submit(core_processings.get_processing_ids_by_status,
+                                                                            status=processing_status,
+                                                                            bulk_size=self.retrieve_bulk_size)
         self.logger.debug("Main thread get %s [submitting + submitted + running] processings to process: %s" % (len(processings), str([processing['processing_id'] for processing in processings])))
         if processings:
             self.logger.info("Main thread get %s [submitting + submitted + running] processings to process: %s" % (len(processings), str([processing['processing_id'] for processing in processings])))
@@ -153,6 +168,10 @@ class Carrier(BaseAgent):
                 core_processings.update_processing_contents(processing_update=processing['processing_update'],
                                                             content_updates=processing['content_updates'])
 
+    def stop(self, signum=None, frame=None):
+        super(Carrier, self).stop(signum=signum, frame=frame)
+        self.prefetch_executor.shutdown(wait=False)
+
     def clean_locks(self):
         self.logger.info("clean locking")
         core_processings.clean_locking()
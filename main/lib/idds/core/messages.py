@@ -34,6 +34,18 @@ def add_message(msg_type, status, source, transform_id, num_contents, msg_conten
                                     bulk_size=bulk_size, msg_content=msg_content, session=session)
 
 
+@transactional_session
+def add_messages(messages, bulk_size=None, session=None):
+    """
+    Add messages in bulk to be submitted asynchronously to a message broker.
+
+    :param messages: list of dictionaries with msg_type, status, source, transform_id, num_contents and msg_content.
+    :param bulk_size: The max number of files in one message.
+    :param session: The database session.
+    """
+    return orm_messages.add_messages(messages=messages, bulk_size=bulk_size, session=session)
+
+
 @read_session
 def retrieve_messages(bulk_size=None, msg_type=None, status=None, source=None, session=None):
     """
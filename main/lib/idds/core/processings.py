@@ -13,9 +13,8 @@
 operations related to Processings.
 """
 
-
 from idds.orm.base.session import read_session, transactional_session
-from idds.common.constants import ProcessingLocking, GranularityType
+from idds.common.constants import GranularityType
 from idds.orm import (processings as orm_processings,
                       collections as orm_collections,
                       contents as orm_contents,
@@ -81,7 +80,8 @@ def get_processings_by_transform_id(transform_id=None, to_json=False, session=No
 
 
 @transactional_session
-def get_processings_by_status(status, time_period=None, locking=False, bulk_size=None, to_json=False, session=None):
+def get_processings_by_status(status, time_period=None, locking=False, bulk_size=None, to_json=False,
+                              deferred_columns=None, session=None):
     """
     Get processing or raise a NoObject exception.
 
@@ -89,19 +89,53 @@ def get_processings_by_status(status, time_period=None, locking=False, bulk_size
     :param time_period: Time period in seconds.
     :param locking: Whether to retrieve only unlocked items and lock them.
     :param to_json: return json format.
+    :param deferred_columns: list of column names which are not loaded, such as processing_metadata and output_metadata.
     :param session: The database session in use.
 
     :raises NoObject: If no processing is founded.
 
     :returns: Processings.
     """
-    processings = orm_processings.get_processings_by_status(status=status, period=time_period, locking=locking,
-                                                            bulk_size=bulk_size, to_json=to_json, session=session)
     if locking:
-        parameters = {'locking': ProcessingLocking.Locking}
-        for processing in processings:
-            orm_processings.update_processing(processing['processing_id'], parameters=parameters, session=session)
-    return processings
+        return orm_processings.claim_processings_by_status(status=status, period=time_period, bulk_size=bulk_size,
+                                                           to_json=to_json, deferred_columns=deferred_columns,
+                                                           session=session)
+    return orm_processings.get_processings_by_status(status=status, period=time_period, locking=locking,
+                                                     bulk_size=bulk_size, to_json=to_json,
+                                                     deferred_columns=deferred_columns, session=session)
+
+
+@read_session
+def get_processing_ids_by_status(status, time_period=None, bulk_size=None, session=None):
+    """
+    Get the ids of unlocked processings with the status, which are due to be polled.
+
+    :param status: Processing status of list of processing status.
+    :param time_period: Time period in seconds.
+    :param bulk_size: bulk size limitation.
+    :param session: The database session in use.
+
+    :returns: list of processing ids.
+    """
+    return orm_processings.get_processing_ids_by_status(status=status, period=time_period, bulk_size=bulk_size,
+                                                        session=session)
+
+
+@transactional_session
+def claim_processings(processing_ids, status, to_json=False, deferred_columns=None, session=None):
+    """
+    Lock the processings with the ids, which are still unlocked, with the status and due to be polled.
+
+    :param processing_ids: list of processing ids.
+    :param status: Processing status of list of processing status.
+    :param to_json: return json format.
+    :param deferred_columns: list of column names which are not loaded, such as processing_metadata and output_metadata.
+    :param session: The database session in use.
+
+    :returns: The claimed processings.
+    """
+    return orm_processings.claim_processings(processing_ids, status=status, to_json=to_json,
+                                             deferred_columns=deferred_columns, session=session)
 
 
 @transactional_session
@@ -120,6 +154,21 @@ def update_processing(processing_id, parameters, session=None):
     return orm_processings.update_processing(processing_id=processing_id, parameters=parameters, session=session)
 
 
+@transactional_session
+def update_processings(parameters, session=None):
+    """
+    update processings in bulk.
+
+    :param parameters: list of dictionary of parameters, every one of them with the processing_id.
+    :param session: The database session in use.
+
+    :raises NoObject: If no processing is founded.
+    :raises DatabaseException: If there is a database error.
+
+    """
+    return orm_processings.update_processings(parameters=parameters, session=session)
+
+
 @transactional_session
 def delete_processing(processing_id=None, session=None):
     """
@@ -155,15 +204,7 @@ def update_processing_with_collection_contents(updated_processing, new_processin
     if file_msg_content:
         if not type(file_msg_content) in [list, tuple]:
             file_msg_content = [file_msg_content]
-        for file_msg_con in file_msg_content:
-            orm_messages.add_message(msg_type=file_msg_con['msg_type'],
-                                     status=file_msg_con['status'],
-                                     source=file_msg_con['source'],
-                                     transform_id=file_msg_con['transform_id'],
-                                     num_contents=file_msg_con['num_contents'],
-                                     msg_content=file_msg_con['msg_content'],
-                                     bulk_size=message_bulk_size,
-                                     session=session)
+        orm_messages.add_messages(file_msg_content, bulk_size=message_bulk_size, session=session)
     if updated_collection:
         orm_collections.update_collection(coll_id=updated_collection['coll_id'],
                                           parameters=updated_collection['parameters'],
@@ -220,5 +261,7 @@ def clean_next_poll_at(status, session=None):
     Clearn next_poll_at.
 
     :param status: status of the processing
+
+    :returns: The number of updated processings.
     """
-    orm_processings.clean_next_poll_at(status=status, session=session)
+    return orm_processings.clean_next_poll_at(status=status, session=session)
@@ -119,7 +119,7 @@ def get_transforms(workprogress_id, to_json=False, session=None):
     return orm_transforms.get_transforms(workprogress_id=workprogress_id, to_json=to_json, session=session)
 
 
-@read_session
+@transactional_session
 def get_transforms_by_status(status, period=None, locking=False, bulk_size=None, to_json=False, session=None):
     """
     Get transforms or raise a NoObject exception.
@@ -133,29 +133,30 @@ def get_transforms_by_status(status, period=None, locking=False, bulk_size=None,
 
     :returns: list of transform.
     """
-    transforms = orm_transforms.get_transforms_by_status(status=status, period=period, locking=locking,
-                                                         bulk_size=bulk_size, to_json=to_json, session=session)
     if locking:
-        parameters = {'locking': TransformLocking.Locking}
-        for transform in transforms:
-            orm_transforms.update_transform(transform_id=transform['transform_id'], parameters=parameters, session=session)
-    return transforms
+        return orm_transforms.claim_transforms_by_status(status=status, period=period, bulk_size=bulk_size,
+                                                         to_json=to_json, session=session)
+    return orm_transforms.get_transforms_by_status(status=status, period=period, locking=locking,
+                                                   bulk_size=bulk_size, to_json=to_json, session=session)
 
 
 @transactional_session
-def update_transform(transform_id, parameters, session=None):
+def update_transform(transform_id, parameters, return_updated=False, session=None):
     """
     update a transform.
 
     :param transform_id: the transform id.
     :param parameters: A dictionary of parameters.
+    :param return_updated: Whether to return the updated transform.
     :param session: The database session in use.
 
     :raises NoObject: If no content is founded.
     :raises DatabaseException: If there is a database error.
 
+    :returns: The updated transform if return_updated is set, otherwise None.
     """
-    orm_transforms.update_transform(transform_id=transform_id, parameters=parameters, session=session)
+    return orm_transforms.update_transform(transform_id=transform_id, parameters=parameters,
+                                           return_updated=return_updated, session=session)
 
 
 @transactional_session
@@ -277,8 +278,10 @@ def clean_locking(time_period=3600, session=None):
     Clearn locking which is older than time period.
 
     :param time_period in seconds
+
+    :returns: The number of updated transforms.
     """
-    orm_transforms.clean_locking(time_period=time_period, session=session)
+    return orm_transforms.clean_locking(time_period=time_period, session=session)
 
 
 @transactional_session
@@ -287,8 +290,10 @@ def clean_next_poll_at(status, session=None):
     Clearn next_poll_at.
 
     :param status: status of the transform
+
+    :returns: The number of updated transforms.
     """
-    orm_transforms.clean_next_poll_at(status=status, session=session)
+    return orm_transforms.clean_next_poll_at(status=status, session=session)
 
 
 @read_session
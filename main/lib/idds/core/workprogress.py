@@ -159,8 +159,8 @@ def update_workprogress(workprogress_id, parameters, new_transforms=None, sessio
     """
 
     if new_transforms:
-        for tf in new_transforms:
-            tf_id = orm_transforms.add_transform(**tf, session=session)
+        tf_ids = orm_transforms.add_transforms(new_transforms, session=session)
+        for tf, tf_id in zip(new_transforms, tf_ids):
             work = tf['transform_metadata']['work']
             work.set_work_id(tf_id, transforming=True)
             work.set_status(WorkStatus.New)
@@ -19,6 +19,7 @@ from enum import Enum
 from sqlalchemy import BigInteger, Boolean, Column, DateTime, Integer, String, event, DDL
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import object_mapper
+from sqlalchemy.sql.expression import FunctionElement
 from sqlalchemy.schema import CheckConstraint, UniqueConstraint, Index, PrimaryKeyConstraint, ForeignKeyConstraint, Sequence, Table
 
 from idds.common.constants import (RequestType, RequestStatus, RequestLocking,
@@ -41,12 +42,76 @@ def compile_binary_oracle(type_, compiler, **kw):
     return "NUMBER(1)"
 
 
+class utcnow(FunctionElement):
+    """
+    The current UTC time of the database, optionally shifted by a number of seconds, such as utcnow(-3600).
+    """
+    type = DateTime()
+    name = 'utcnow'
+
+
+def _utcnow_offset(element, compiler, **kw):
+    clauses = list(element.clauses)
+    if clauses:
+        return compiler.process(clauses[0], **kw)
+    return None
+
+
+@compiles(utcnow)
+def compile_utcnow(element, compiler, **kw):
+    offset = _utcnow_offset(element, compiler, **kw)
+    if offset is None:
+        return "CURRENT_TIMESTAMP"
+    return "CURRENT_TIMESTAMP + %s * INTERVAL '1' SECOND" % offset
+
+
+@compiles(utcnow, "postgresql")
+def compile_utcnow_postgresql(element, compiler, **kw):
+    offset = _utcnow_offset(element, compiler, **kw)
+    if offset is None:
+        return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP) + %s * INTERVAL '1 second'" % offset
+
+
+@compiles(utcnow, "oracle")
+def compile_utcnow_oracle(element, compiler, **kw):
+    offset = _utcnow_offset(element, compiler, **kw)
+    if offset is None:
+        return "SYS_EXTRACT_UTC(SYSTIMESTAMP)"
+    return "SYS_EXTRACT_UTC(SYSTIMESTAMP) + NUMTODSINTERVAL(%s, 'SECOND')" % offset
+
+
+@compiles(utcnow, "mysql")
+def compile_utcnow_mysql(element, compiler, **kw):
+    offset = _utcnow_offset(element, compiler, **kw)
+    if offset is None:
+        return "UTC_TIMESTAMP(6)"
+    return "UTC_TIMESTAMP(6) + INTERVAL %s SECOND" % offset
+
+
+@compiles(utcnow, "sqlite")
+def compile_utcnow_sqlite(element, compiler, **kw):
+    # sqlite has milliseconds, the padding matches the microseconds format of the stored datetimes.
+    offset = _utcnow_offset(element, compiler, **kw)
+    if offset is None:
+        return "STRFTIME('%Y-%m-%d %H:%M:%f', 'now') || '000'"
+    return "STRFTIME('%%Y-%%m-%%d %%H:%%M:%%f', 'now', %s || ' seconds') || '000'" % offset
+
+
 @event.listens_for(Table, "after_create")
 def _psql_autoincrement(target, connection, **kw):
     if connection.dialect.name == 'mysql' and target.name == 'ess_coll':
         DDL("alter table ess_coll modify coll_id bigint(20) not null unique auto_increment")
 
 
+@event.listens_for(Table, "after_create")
+def _psql_processings_locking_idx(target, connection, **kw):
+    # partial index for clean_locking, which only looks for the locked processings.
+    if connection.dialect.name == 'postgresql' and target.name == 'processings':
+        DDL("CREATE INDEX PROCESSINGS_LOCKING_IDX ON %%(fullname)s (locking, updated_at) WHERE locking = %s"
+            % ProcessingLocking.Locking.value).execute(connection, target)
+
+
 class ModelBase(object):
     """Base class for IDDS Models"""
 
@@ -147,7 +212,8 @@ class Request(BASE, ModelBase):
                    CheckConstraint('status IS NOT NULL', name='REQUESTS_STATUS_ID_NN'),
                    # UniqueConstraint('name', 'scope', 'requester', 'request_type', 'transform_tag', 'workload_id', name='REQUESTS_NAME_SCOPE_UQ '),
                    Index('REQUESTS_SCOPE_NAME_IDX', 'workload_id', 'request_id', 'name', 'scope'),
-                   Index('REQUESTS_STATUS_PRIO_IDX', 'status', 'priority', 'workload_id', 'request_id', 'locking', 'updated_at', 'next_poll_at', 'created_at'))
+                   Index('REQUESTS_STATUS_PRIO_IDX', 'status', 'priority', 'workload_id', 'request_id', 'locking', 'updated_at', 'next_poll_at', 'created_at'),
+                   Index('REQUESTS_WORKLOAD_ID_IDX', 'workload_id', 'request_id'))
 
 
 class Workprogress(BASE, ModelBase):
@@ -208,6 +274,18 @@ class Transform(BASE, ModelBase):
                    Index('TRANSFORMS_STATUS_UPDATED_IDX', 'status', 'locking', 'updated_at', 'next_poll_at', 'created_at'))
 
 
+class Req2transform(BASE, ModelBase):
+    """Represents a request to transform"""
+    __tablename__ = 'req2transforms'
+    request_id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    transform_id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+
+    _table_args = (PrimaryKeyConstraint('request_id', 'transform_id', name='REQ2TRANSFORM_PK'),
+                   ForeignKeyConstraint(['request_id'], ['requests.request_id'], name='REQ2TRANSFORM_REQ_ID_FK'),
+                   ForeignKeyConstraint(['transform_id'], ['transforms.transform_id'], name='REQ2TRANSFORM_TRANS_ID_FK'),
+                   Index('REQ2TRANSFORM_TRANS_ID_IDX', 'transform_id', 'request_id'))
+
+
 class Workprogress2transform(BASE, ModelBase):
     """Represents a workprogress to transform"""
     __tablename__ = 'wp2transforms'
@@ -244,7 +322,9 @@ class Processing(BASE, ModelBase):
                    ForeignKeyConstraint(['transform_id'], ['transforms.transform_id'], name='PROCESSINGS_TRANSFORM_ID_FK'),
                    CheckConstraint('status IS NOT NULL', name='PROCESSINGS_STATUS_ID_NN'),
                    CheckConstraint('transform_id IS NOT NULL', name='PROCESSINGS_TRANSFORM_ID_NN'),
-                   Index('PROCESSINGS_STATUS_UPDATED_IDX', 'status', 'locking', 'updated_at', 'next_poll_at', 'created_at'))
+                   Index('PROCESSINGS_STATUS_UPDATED_IDX', 'status', 'locking', 'updated_at', 'next_poll_at', 'created_at'),
+                   Index('PROCESSINGS_STATUS_POLL_IDX', 'status', 'next_poll_at', 'locking'),
+                   Index('PROCESSINGS_LOCKING_IDX', 'locking', 'updated_at'))
 
 
 class Collection(BASE, ModelBase):
@@ -349,7 +429,7 @@ def register_models(engine):
     Creates database tables for all models with the given engine
     """
 
-    models = (Request, Workprogress, Transform, Workprogress2transform, Processing, Collection, Content)
+    models = (Request, Workprogress, Transform, Req2transform, Workprogress2transform, Processing, Collection, Content)
 
     for model in models:
         model.metadata.create_all(engine)   # pylint: disable=maybe-no-member
@@ -360,7 +440,7 @@ def unregister_models(engine):
     Drops database tables for all models with the given engine
     """
 
-    models = (Request, Workprogress, Transform, Workprogress2transform, Processing, Collection, Content)
+    models = (Request, Workprogress, Transform, Req2transform, Workprogress2transform, Processing, Collection, Content)
 
     for model in models:
         model.metadata.drop_all(engine)   # pylint: disable=maybe-no-member
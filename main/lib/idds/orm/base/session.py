@@ -18,18 +18,18 @@ https://github.com/rucio/rucio/blob/master/lib/rucio/db/sqla/session.py
 import sys
 
 from functools import wraps
-from inspect import isgeneratorfunction
+from inspect import isgeneratorfunction, signature
 from retrying import retry
 from threading import Lock
 from os.path import basename
 
 from sqlalchemy import create_engine, event
-from sqlalchemy.exc import DatabaseError, DisconnectionError, OperationalError, TimeoutError
+from sqlalchemy.exc import DatabaseError, DisconnectionError, IntegrityError, OperationalError, TimeoutError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 
 from idds.common.config import config_get, config_has_option
-from idds.common.exceptions import IDDSException, DatabaseException
+from idds.common.exceptions import IDDSException, DatabaseException, DuplicatedObject
 
 
 DATABASE_SECTION = 'database'
@@ -134,7 +134,7 @@ def get_engine(echo=True):
         sql_connection = config_get(DATABASE_SECTION, 'default')
         config_params = [('pool_size', int), ('max_overflow', int), ('pool_timeout', int),
                          ('pool_recycle', int), ('echo', int), ('echo_pool', str),
-                         ('pool_reset_on_return', str), ('use_threadlocal', int)]
+                         ('pool_reset_on_return', str), ('use_threadlocal', int), ('pool_pre_ping', int)]
         # params = {'max_identifier_length': 128}
         params = {}
         for param, param_type in config_params:
@@ -142,6 +142,10 @@ def get_engine(echo=True):
                 params[param] = param_type(config_get(DATABASE_SECTION, param))
             except:  # noqa: B901
                 pass
+        if 'sqlite' not in sql_connection:
+            # defaults for a pool shared by the agent threads, when they are not configured.
+            for param, value in [('pool_size', 20), ('max_overflow', 40), ('pool_recycle', 1800), ('pool_pre_ping', 1)]:
+                params.setdefault(param, value)
         params['execution_options'] = {'schema_translate_map': {None: DEFAULT_SCHEMA_NAME}}
         _ENGINE = create_engine(sql_connection, **params)
 
@@ -351,3 +355,28 @@ def transactional_session(function):
         return result
     new_funct.__doc__ = function.__doc__
     return new_funct
+
+
+def translate_db_errors(duplicated_msg='Object already exists!'):
+    '''
+    decorator that translates the database errors raised inside a function to iDDS exceptions.
+    It should be applied below the session decorators, which otherwise translate an IntegrityError to a DatabaseException.
+
+    :param duplicated_msg: The message of the DuplicatedObject exception raised for an IntegrityError.
+                           It's formatted with the arguments of the function, for example '%(transform_id)s'.
+    '''
+    def decorator(function):
+        function_signature = signature(function)
+
+        @wraps(function)
+        def new_funct(*args, **kwargs):
+            try:
+                return function(*args, **kwargs)
+            except IntegrityError as error:
+                arguments = function_signature.bind(*args, **kwargs)
+                arguments.apply_defaults()
+                raise DuplicatedObject('%s: %s' % (duplicated_msg % arguments.arguments, error))
+            except DatabaseError as error:
+                raise DatabaseException(error)
+        return new_funct
+    return decorator
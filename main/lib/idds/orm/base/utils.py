@@ -88,20 +88,15 @@ def dump_schema():
     models.register_models(engine)
 
 
-def row2dict(row):
+def row2dict(row, to_json=False):
     """ Convert rows to dict. """
-    row_dict = {}
-    for col in row.keys():
-        row_dict[str(col)] = row[col]
-    return row_dict
+    # the values are taken from the row tuple directly instead of a named lookup per column.
+    if to_json:
+        expand_item = models.ModelBase._expand_item
+        return {str(col): expand_item(value) for col, value in zip(row.keys(), row)}
+    return dict(zip(row.keys(), row))
 
 
 def rows2dict(rows):
     """ Convert rows to dict. """
-    results = []
-    for row in rows:
-        row_dict = {}
-        for col in row.keys():
-            row_dict[str(col)] = row[col]
-        results.append(row_dict)
-    return results
+    return [row2dict(row) for row in rows]
@@ -16,7 +16,6 @@ operations related to Messages.
 import re
 import copy
 
-from sqlalchemy import or_
 from sqlalchemy.exc import DatabaseError, IntegrityError
 
 from idds.common import exceptions
@@ -37,29 +36,55 @@ def add_message(msg_type, status, source, transform_id, num_contents, msg_conten
     :param msg_content: The message msg_content as JSON.
     :param session: The database session.
     """
+    message = {'msg_type': msg_type, 'status': status, 'source': source, 'transform_id': transform_id,
+               'num_contents': num_contents, 'msg_content': msg_content}
+    return add_messages([message], bulk_size=bulk_size, session=session)
+
+
+def split_message(message, bulk_size=None):
+    """
+    Split a message whose files are more than bulk_size into several messages.
+
+    :param message: dictionary of the message.
+    :param bulk_size: The max number of files in one message.
+
+    :returns: list of messages.
+    """
+    if bulk_size and message['num_contents'] > bulk_size and 'files' in message['msg_content']:
+        files = message['msg_content']['files']
+        new_messages = []
+        for i in range(0, len(files), bulk_size):
+            chunk = files[i:i + bulk_size]
+            new_msg_content = copy.deepcopy(message['msg_content'])
+            new_msg_content['files'] = chunk
+            new_messages.append(dict(message, num_contents=len(chunk), msg_content=new_msg_content))
+        return new_messages
+    return [message]
+
+
+@transactional_session
+def add_messages(messages, bulk_size=None, session=None):
+    """
+    Add messages in bulk to be submitted asynchronously to a message broker.
+
+    :param messages: list of dictionaries with msg_type, status, source, transform_id, num_contents and msg_content.
+    :param bulk_size: The max number of files in one message.
+    :param session: The database session.
+    """
 
     try:
-        num_contents_list = []
-        msg_content_list = []
-        if bulk_size and num_contents > bulk_size:
-            if 'files' in msg_content:
-                files = msg_content['files']
-                chunks = [files[i:i + bulk_size] for i in range(0, len(files), bulk_size)]
-                for chunk in chunks:
-                    new_msg_content = copy.deepcopy(msg_content)
-                    new_msg_content['files'] = chunk
-                    new_num_contents = len(chunk)
-                    num_contents_list.append(new_num_contents)
-                    msg_content_list.append(new_msg_content)
-        else:
-            num_contents_list.append(num_contents)
-            msg_content_list.append(msg_content)
-
-        for msg_content, num_contents in zip(msg_content_list, num_contents_list):
-            new_message = models.Message(msg_type=msg_type, status=status, transform_id=transform_id,
-                                         source=source, num_contents=num_contents,
-                                         locking=0, msg_content=msg_content)
-            new_message.save(session=session)
+        new_messages = []
+        for message in messages:
+            for new_message in split_message(message, bulk_size=bulk_size):
+                new_messages.append({'msg_type': new_message['msg_type'],
+                                     'status': new_message['status'],
+                                     'source': new_message['source'],
+                                     'transform_id': new_message['transform_id'],
+                                     'num_contents': new_message['num_contents'],
+                                     'locking': 0,
+                                     'msg_content': new_message['msg_content']})
+        if new_messages:
+            session.bulk_insert_mappings(models.Message, new_messages)
     except TypeError as e:
         raise exceptions.DatabaseException('Invalid JSON for msg_content: %s' % str(e))
     except DatabaseError as e:
@@ -113,15 +138,13 @@ def delete_messages(messages, session=None):
 
     :param messages: The messages to delete as a list of dictionaries.
     """
-    message_condition = []
-    for message in messages:
-        message_condition.append(models.Message.msg_id == message['msg_id'])
+    msg_ids = [message['msg_id'] for message in messages]
 
     try:
-        if message_condition:
+        if msg_ids:
             session.query(models.Message).\
                 with_hint(models.Message, "index(messages MESSAGES_PK)", 'oracle').\
-                filter(or_(*message_condition)).\
+                filter(models.Message.msg_id.in_(msg_ids)).\
                 delete(synchronize_session=False)
     except IntegrityError as e:
         raise exceptions.DatabaseException(e.args)
@@ -135,7 +158,7 @@ def update_messages(messages, session=None):
     :param messages: The messages to be updated as a list of dictionaries.
     """
     try:
-        for msg in messages:
-            session.query(models.Message).filter_by(msg_id=msg['msg_id']).update({'status': msg['status']}, synchronize_session=False)
+        parameters = [{'msg_id': msg['msg_id'], 'status': msg['status']} for msg in messages]
+        session.bulk_update_mappings(models.Message, parameters)
     except IntegrityError as e:
         raise exceptions.DatabaseException(e.args)
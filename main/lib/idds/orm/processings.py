@@ -22,6 +22,7 @@ from sqlalchemy.sql.expression import asc
 from idds.common import exceptions
 from idds.common.constants import ProcessingStatus, ProcessingLocking, GranularityType
 from idds.orm.base.session import read_session, transactional_session
+from idds.orm.base.utils import row2dict
 from idds.orm.base import models
 
 
@@ -83,6 +84,19 @@ def add_processing(transform_id, status=ProcessingStatus.New, locking=Processing
         raise exceptions.DatabaseException(error)
 
 
+def get_processing_columns(deferred_columns=None):
+    """
+    Get the processing columns to be selected.
+
+    :param deferred_columns: list of column names which are not loaded, such as processing_metadata and output_metadata.
+
+    :returns: list of columns.
+    """
+    if not deferred_columns:
+        return [models.Processing.__table__]
+    return [column for column in models.Processing.__table__.columns if column.name not in deferred_columns]
+
+
 @read_session
 def get_processing(processing_id, to_json=False, session=None):
     """
@@ -99,16 +113,13 @@ def get_processing(processing_id, to_json=False, session=None):
     """
 
     try:
-        query = session.query(models.Processing)\
-                       .filter_by(processing_id=processing_id)
+        query = session.query(models.Processing.__table__)\
+                       .filter(models.Processing.processing_id == processing_id)
         ret = query.first()
         if not ret:
             return None
         else:
-            if to_json:
-                return ret.to_dict_json()
-            else:
-                return ret.to_dict()
+            return row2dict(ret, to_json=to_json)
     except sqlalchemy.orm.exc.NoResultFound as error:
         raise exceptions.NoObject('Processing(processing_id: %s) cannot be found: %s' %
                                   (processing_id, error))
@@ -130,21 +141,11 @@ def get_processings_by_transform_id(transform_id=None, to_json=False, session=No
     """
 
     try:
-        query = session.query(models.Processing)\
-                       .filter_by(transform_id=transform_id)
+        query = session.query(models.Processing.__table__)\
+                       .filter(models.Processing.transform_id == transform_id)
         query = query.order_by(asc(models.Processing.processing_id))
 
-        ret = query.all()
-        if not ret:
-            return []
-        else:
-            items = []
-            for t in ret:
-                if to_json:
-                    items.append(t.to_dict_json())
-                else:
-                    items.append(t.to_dict())
-            return items
+        return [row2dict(t, to_json=to_json) for t in query.all()]
     except sqlalchemy.orm.exc.NoResultFound as error:
         raise exceptions.NoObject('Processings(transform_id: %s) cannot be found: %s' %
                                   (transform_id, error))
@@ -153,7 +154,8 @@ def get_processings_by_transform_id(transform_id=None, to_json=False, session=No
 
 
 @read_session
-def get_processings_by_status(status, period=None, locking=False, bulk_size=None, submitter=None, to_json=False, session=None):
+def get_processings_by_status(status, period=None, locking=False, bulk_size=None, submitter=None, to_json=False,
+                              deferred_columns=None, session=None):
     """
     Get processing or raise a NoObject exception.
 
@@ -163,6 +165,7 @@ def get_processings_by_status(status, period=None, locking=False, bulk_size=None
     :param bulk_size: bulk size limitation.
     :param submitter: The submitter name.
     :param to_json: return json format.
+    :param deferred_columns: list of column names which are not loaded, such as processing_metadata and output_metadata.
 
     :param session: The database session in use.
 
@@ -174,15 +177,14 @@ def get_processings_by_status(status, period=None, locking=False, bulk_size=None
     try:
         if not isinstance(status, (list, tuple)):
             status = [status]
-        if len(status) == 1:
-            status = [status[0], status[0]]
 
-        query = session.query(models.Processing)\
+        now = datetime.datetime.utcnow()
+        query = session.query(*get_processing_columns(deferred_columns))\
                        .filter(models.Processing.status.in_(status))\
-                       .filter(models.Processing.next_poll_at < datetime.datetime.utcnow())
+                       .filter(models.Processing.next_poll_at < now)
 
         if period:
-            query = query.filter(models.Processing.updated_at < datetime.datetime.utcnow() - datetime.timedelta(seconds=period))
+            query = query.filter(models.Processing.updated_at < now - datetime.timedelta(seconds=period))
         if locking:
             query = query.filter(models.Processing.locking == ProcessingLocking.Idle)
         if submitter:
@@ -193,15 +195,112 @@ def get_processings_by_status(status, period=None, locking=False, bulk_size=None
         if bulk_size:
             query = query.limit(bulk_size)
 
-        tmp = query.all()
-        rets = []
-        if tmp:
-            for t in tmp:
-                if to_json:
-                    rets.append(t.to_dict_json())
-                else:
-                    rets.append(t.to_dict())
-        return rets
+        return [row2dict(t, to_json=to_json) for t in query.yield_per(1000)]
+    except sqlalchemy.orm.exc.NoResultFound as error:
+        raise exceptions.NoObject('No processing attached with status (%s): %s' % (status, error))
+    except Exception as error:
+        raise error
+
+
+@read_session
+def get_processing_ids_by_status(status, period=None, bulk_size=None, submitter=None, session=None):
+    """
+    Get the ids of unlocked processings with the status, which are due to be polled.
+
+    :param status: Processing status of list of processing status.
+    :param period: Time period in seconds.
+    :param bulk_size: bulk size limitation.
+    :param submitter: The submitter name.
+    :param session: The database session in use.
+
+    :returns: list of processing ids.
+    """
+    if not isinstance(status, (list, tuple)):
+        status = [status]
+
+    now = datetime.datetime.utcnow()
+    query = session.query(models.Processing.processing_id)\
+                   .filter(models.Processing.status.in_(status))\
+                   .filter(models.Processing.next_poll_at < now)\
+                   .filter(models.Processing.locking == ProcessingLocking.Idle)
+
+    if period:
+        query = query.filter(models.Processing.updated_at < now - datetime.timedelta(seconds=period))
+    if submitter:
+        query = query.filter(models.Processing.submitter == submitter)
+
+    query = query.order_by(asc(models.Processing.updated_at))
+
+    if bulk_size:
+        query = query.limit(bulk_size)
+    return [processing_id for processing_id, in query.all()]
+
+
+@transactional_session
+def claim_processings(processing_ids, status, to_json=False, deferred_columns=None, session=None):
+    """
+    Lock the processings with the ids, which are still unlocked, with the status and due to be polled.
+    Rows which are locked by another transaction are skipped, so that several agents can claim processings concurrently.
+
+    :param processing_ids: list of processing ids.
+    :param status: Processing status of list of processing status.
+    :param to_json: return json format.
+    :param deferred_columns: list of column names which are not loaded, such as processing_metadata and output_metadata.
+    :param session: The database session in use.
+
+    :returns: The claimed processings.
+    """
+    if not processing_ids:
+        return []
+    if not isinstance(status, (list, tuple)):
+        status = [status]
+
+    # 'FOR UPDATE' cannot be combined with an ordered and limited query on Oracle,
+    # so the processings are locked by their primary keys.
+    now = datetime.datetime.utcnow()
+    query = session.query(*get_processing_columns(deferred_columns))\
+                   .filter(models.Processing.processing_id.in_(processing_ids))\
+                   .filter(models.Processing.status.in_(status))\
+                   .filter(models.Processing.next_poll_at < now)\
+                   .filter(models.Processing.locking == ProcessingLocking.Idle)\
+                   .with_for_update(skip_locked=True)
+    processings = [row2dict(t, to_json=to_json) for t in query.all()]
+    if processings:
+        session.query(models.Processing)\
+               .filter(models.Processing.processing_id.in_([p['processing_id'] for p in processings]))\
+               .update({'locking': ProcessingLocking.Locking, 'updated_at': now}, synchronize_session=False)
+        for processing in processings:
+            processing['locking'] = ProcessingLocking.Locking
+            processing['updated_at'] = now
+    return processings
+
+
+@transactional_session
+def claim_processings_by_status(status, period=None, bulk_size=None, submitter=None, to_json=False,
+                                deferred_columns=None, session=None):
+    """
+    Get unlocked processings with the status and lock them in the same transaction.
+    Rows which are locked by another transaction are skipped, so that several agents can claim processings concurrently.
+
+    :param status: Processing status of list of processing status.
+    :param period: Time period in seconds.
+    :param bulk_size: bulk size limitation.
+    :param submitter: The submitter name.
+    :param to_json: return json format.
+    :param deferred_columns: list of column names which are not loaded, such as processing_metadata and output_metadata.
+
+    :param session: The database session in use.
+
+    :raises NoObject: If no processing is founded.
+
+    :returns: Processings.
+    """
+
+    try:
+        processing_ids = get_processing_ids_by_status(status=status, period=period, bulk_size=bulk_size,
+                                                      submitter=submitter, session=session)
+        return claim_processings(processing_ids, status=status, to_json=to_json,
+                                 deferred_columns=deferred_columns, session=session)
     except sqlalchemy.orm.exc.NoResultFound as error:
         raise exceptions.NoObject('No processing attached with status (%s): %s' % (status, error))
     except Exception as error:
@@ -222,11 +321,11 @@ def update_processing(processing_id, parameters, session=None):
 
     """
     try:
-
-        parameters['updated_at'] = datetime.datetime.utcnow()
+        now = datetime.datetime.utcnow()
+        parameters['updated_at'] = now
         if 'status' in parameters and parameters['status'] in [ProcessingStatus.Finished, ProcessingStatus.Failed,
                                                                ProcessingStatus.Lost]:
-            parameters['finished_at'] = datetime.datetime.utcnow()
+            parameters['finished_at'] = now
 
         session.query(models.Processing).filter_by(processing_id=processing_id)\
                .update(parameters, synchronize_session=False)
@@ -234,6 +333,33 @@ def update_processing(processing_id, parameters, session=None):
         raise exceptions.NoObject('Processing %s cannot be found: %s' % (processing_id, error))
 
 
+@transactional_session
+def update_processings(parameters, now=None, session=None):
+    """
+    update processings in bulk.
+
+    :param parameters: list of dictionary of parameters, every one of them with the processing_id.
+    :param now: The update time for all processings. If it's None, the current utc time is used.
+    :param session: The database session in use.
+
+    :raises NoObject: If no processing is founded.
+    :raises DatabaseException: If there is a database error.
+
+    """
+    try:
+        if now is None:
+            now = datetime.datetime.utcnow()
+        for parameter in parameters:
+            parameter['updated_at'] = now
+            if 'status' in parameter and parameter['status'] in [ProcessingStatus.Finished, ProcessingStatus.Failed,
+                                                                 ProcessingStatus.Lost]:
+                parameter['finished_at'] = now
+
+        session.bulk_update_mappings(models.Processing, parameters)
+    except sqlalchemy.orm.exc.NoResultFound as error:
+        raise exceptions.NoObject('Processing cannot be found: %s' % (error))
+
+
 @transactional_session
 def delete_processing(processing_id=None, session=None):
     """
@@ -270,12 +396,15 @@ def clean_next_poll_at(status, session=None):
     Clearn next_poll_at.
 
     :param status: status of the processing
+
+    :returns: The number of updated processings.
     """
     if not isinstance(status, (list, tuple)):
         status = [status]
-    if len(status) == 1:
-        status = [status[0], status[0]]
 
-    params = {'next_poll_at': datetime.datetime.utcnow()}
-    session.query(models.Processing).filter(models.Processing.status.in_(status))\
-           .update(params, synchronize_session=False)
+    # processings which are already due are not rewritten, so nothing is written when there is nothing to clean.
+    now = datetime.datetime.utcnow()
+    params = {'next_poll_at': now}
+    return session.query(models.Processing).filter(models.Processing.status.in_(status))\
+                  .filter(models.Processing.next_poll_at > now)\
+                  .update(params, synchronize_session=False)
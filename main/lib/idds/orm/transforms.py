@@ -13,19 +13,35 @@
 operations related to Transform.
 """
 
-import datetime
-
 import sqlalchemy
-from sqlalchemy import and_
-from sqlalchemy.exc import DatabaseError, IntegrityError
+from sqlalchemy import and_, bindparam, text
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import scoped_session
+from sqlalchemy.orm.util import identity_key
 from sqlalchemy.sql.expression import asc, desc
 
 from idds.common import exceptions
 from idds.common.constants import TransformStatus, TransformLocking, CollectionRelationType
-from idds.orm.base.session import read_session, transactional_session
+from idds.orm.base.session import read_session, transactional_session, translate_db_errors
+from idds.orm.base.utils import row2dict
 from idds.orm.base import models
 
 
+# cache of the constructed and compiled hot queries.
+bakery = baked.bakery()
+
+
+def get_baked_session(session):
+    """
+    Get the session to run baked queries, which need the session itself instead of the scoped session.
+
+    :param session: The database session in use.
+    """
+    if isinstance(session, scoped_session):
+        return session()
+    return session
+
+
 def create_transform(transform_type, transform_tag=None, priority=0, status=TransformStatus.New, locking=TransformLocking.Idle,
                      retries=0, expired_at=None, transform_metadata=None):
     """
@@ -49,6 +65,7 @@ def create_transform(transform_type, transform_tag=None, priority=0, status=Tran
 
 
 @transactional_session
+@translate_db_errors("Transform already exists!")
 def add_transform(transform_type, transform_tag=None, priority=0, status=TransformStatus.New, locking=TransformLocking.Idle,
                   retries=0, expired_at=None, transform_metadata=None, workprogress_id=None, session=None):
     """
@@ -68,25 +85,93 @@ def add_transform(transform_type, transform_tag=None, priority=0, status=Transfo
 
     :returns: transform id.
     """
-    try:
-        new_transform = create_transform(transform_type=transform_type, transform_tag=transform_tag, priority=priority,
-                                         status=status, locking=locking, retries=retries, expired_at=expired_at,
-                                         transform_metadata=transform_metadata)
-        new_transform.save(session=session)
-        transform_id = new_transform.transform_id
+    # core inserts skip the unit of work flush. The dialects with RETURNING (postgres, oracle)
+    # get the transform_id back with the insert itself.
+    insert = models.Transform.__table__.insert().values(transform_type=transform_type, transform_tag=transform_tag,
+                                                        priority=priority, status=status, locking=locking,
+                                                        retries=retries, expired_at=expired_at,
+                                                        transform_metadata=transform_metadata)
+    transform_id = session.execute(insert).inserted_primary_key[0]
 
-        if workprogress_id:
-            new_wp2transform = models.Workprogress2transform(workprogress_id=workprogress_id, transform_id=transform_id)
-            new_wp2transform.save(session=session)
+    if workprogress_id:
+        insert = models.Workprogress2transform.__table__.insert().values(workprogress_id=workprogress_id,
+                                                                         transform_id=transform_id)
+        session.execute(insert)
 
-        return transform_id
-    except IntegrityError as error:
-        raise exceptions.DuplicatedObject('Transform already exists!: %s' % (error))
-    except DatabaseError as error:
-        raise exceptions.DatabaseException(error)
+    return transform_id
+
+
+def get_transform_ids_from_sequence(num, session=None):
+    """
+    Get new transform ids from TRANSFORM_ID_SEQ with one query.
+
+    :param num: The number of ids.
+    :param session: The database session in use.
+
+    :returns: list of transform ids, or None if the backend has no sequences.
+    """
+    dialect = session.bind.dialect
+    sequence = models.Transform.__table__.c.transform_id.default
+    if not num or dialect.name not in ['oracle', 'postgresql']:
+        return None
+
+    sequence_name = dialect.identifier_preparer.format_sequence(sequence)
+    if dialect.name == 'oracle':
+        sql = 'SELECT %s.nextval FROM dual CONNECT BY level <= :num' % sequence_name
+    else:
+        sql = "SELECT nextval('%s') FROM generate_series(1, :num)" % sequence_name
+    return [transform_id for transform_id, in session.execute(text(sql), {'num': num})]
 
 
 @transactional_session
+@translate_db_errors("Transform already exists!")
+def add_transforms(transforms, bulk_size=1000, session=None):
+    """
+    Add transforms in bulk.
+
+    :param transforms: list of dictionaries with the parameters of add_transform.
+    :param bulk_size: The number of transforms inserted in one statement.
+    :param session: The database session in use.
+
+    :raises DuplicatedObject: If a transform with the same name exists.
+    :raises DatabaseException: If there is a database error.
+
+    :returns: list of transform ids.
+    """
+    default_params = {'transform_tag': None, 'priority': 0, 'status': TransformStatus.New,
+                      'locking': TransformLocking.Idle, 'retries': 0, 'expired_at': None,
+                      'transform_metadata': None}
+
+    new_transforms = []
+    for transform in transforms:
+        new_transform = {key: transform.get(key, default_params[key]) for key in default_params}
+        new_transform['transform_type'] = transform['transform_type']
+        new_transforms.append(new_transform)
+
+    sub_params = [new_transforms[i:i + bulk_size] for i in range(0, len(new_transforms), bulk_size)]
+
+    transform_ids = get_transform_ids_from_sequence(len(new_transforms), session=session)
+    if transform_ids:
+        # with the ids already known, every chunk is inserted with one executemany.
+        for new_transform, transform_id in zip(new_transforms, transform_ids):
+            new_transform['transform_id'] = transform_id
+        for sub_param in sub_params:
+            session.bulk_insert_mappings(models.Transform, sub_param)
+    else:
+        # without sequences (sqlite, mysql) the ids are only known after inserting the rows one by one.
+        for sub_param in sub_params:
+            session.bulk_insert_mappings(models.Transform, sub_param, return_defaults=True)
+        transform_ids = [new_transform['transform_id'] for new_transform in new_transforms]
+
+    wp2transforms = [{'workprogress_id': transform['workprogress_id'], 'transform_id': transform_id}
+                     for transform, transform_id in zip(transforms, transform_ids) if transform.get('workprogress_id')]
+    if wp2transforms:
+        session.bulk_insert_mappings(models.Workprogress2transform, wp2transforms)
+    return transform_ids
+
+
+@transactional_session
+@translate_db_errors("Request2Transform already exists!(%(request_id)s:%(transform_id)s)")
 def add_req2transform(request_id, transform_id, session=None):
     """
     Add the relation between request_id and transform_id
@@ -95,17 +180,28 @@ def add_req2transform(request_id, transform_id, session=None):
     :param transform_id: Transform id.
     :param session: The database session in use.
     """
-    try:
-        new_req2transform = models.Req2transform(request_id=request_id, transform_id=transform_id)
-        new_req2transform.save(session=session)
-    except IntegrityError as error:
-        raise exceptions.DuplicatedObject('Request2Transform already exists!(%s:%s): %s' %
-                                          (request_id, transform_id, error))
-    except DatabaseError as error:
-        raise exceptions.DatabaseException(error)
+    new_req2transform = models.Req2transform(request_id=request_id, transform_id=transform_id)
+    new_req2transform.save(session=session)
 
 
 @transactional_session
+@translate_db_errors("Request2Transform already exists!")
+def add_req2transforms(req2transforms, bulk_size=1000, session=None):
+    """
+    Add the relations between requests and transforms in bulk.
+
+    :param req2transforms: list of dictionaries with request_id and transform_id.
+    :param bulk_size: The number of relations inserted in one statement.
+    :param session: The database session in use.
+    """
+    sub_params = [req2transforms[i:i + bulk_size] for i in range(0, len(req2transforms), bulk_size)]
+
+    for sub_param in sub_params:
+        session.bulk_insert_mappings(models.Req2transform, sub_param)
+
+
+@transactional_session
+@translate_db_errors("Workprogress2Transform already exists!(%(workprogress_id)s:%(transform_id)s)")
 def add_wp2transform(workprogress_id, transform_id, session=None):
     """
     Add the relation between workprogress_id and transform_id
@@ -114,14 +210,8 @@ def add_wp2transform(workprogress_id, transform_id, session=None):
     :param transform_id: Transform id.
     :param session: The database session in use.
     """
-    try:
-        new_wp2transform = models.Workprogress2transform(workprogress_id=workprogress_id, transform_id=transform_id)
-        new_wp2transform.save(session=session)
-    except IntegrityError as error:
-        raise exceptions.DuplicatedObject('Workprogress2Transform already exists!(%s:%s): %s' %
-                                          (workprogress_id, transform_id, error))
-    except DatabaseError as error:
-        raise exceptions.DatabaseException(error)
+    new_wp2transform = models.Workprogress2transform(workprogress_id=workprogress_id, transform_id=transform_id)
+    new_wp2transform.save(session=session)
 
 
 @read_session
@@ -138,9 +228,8 @@ def get_transform(transform_id, to_json=False, session=None):
     """
 
     try:
-        query = session.query(models.Transform)\
-                       .filter(models.Transform.transform_id == transform_id)
-        ret = query.first()
+        # get() returns the transform from the session identity map without a query if it's already loaded.
+        ret = bakery(lambda session: session.query(models.Transform))(get_baked_session(session)).get(transform_id)
         if not ret:
             return None
         else:
@@ -174,24 +263,15 @@ def get_transforms_with_input_collection(transform_type, transform_tag, coll_sco
     """
 
     try:
-        subquery = session.query(models.Collection.transform_id)\
-                          .filter(models.Collection.scope == coll_scope)\
-                          .filter(models.Collection.name == coll_name)\
-                          .filter(models.Collection.relation_type == CollectionRelationType.Input)\
-                          .subquery()
-        query = session.query(models.Transform)\
-                       .join(subquery, and_(subquery.c.transform_id == models.Transform.transform_id,
-                                            models.Transform.transform_type == transform_type,
-                                            models.Transform.transform_tag == transform_tag))
-        tmp = query.all()
-        rets = []
-        if tmp:
-            for transf in tmp:
-                if to_json:
-                    rets.append(transf.to_dict_json())
-                else:
-                    rets.append(transf.to_dict())
-        return rets
+        input_coll = sqlalchemy.exists().where(and_(models.Collection.transform_id == models.Transform.transform_id,
+                                                    models.Collection.scope == coll_scope,
+                                                    models.Collection.name == coll_name,
+                                                    models.Collection.relation_type == CollectionRelationType.Input))
+        query = session.query(models.Transform.__table__)\
+                       .filter(models.Transform.transform_type == transform_type)\
+                       .filter(models.Transform.transform_tag == transform_tag)\
+                       .filter(input_coll)
+        return [row2dict(t, to_json=to_json) for t in query.yield_per(1000)]
     except sqlalchemy.orm.exc.NoResultFound as error:
         raise exceptions.NoObject('Transform(transform_type: %s, transform_tag: %s, coll_scope: %s, coll_name: %s) cannot be found: %s' %
                                   (transform_type, transform_tag, coll_scope, coll_name, error))
@@ -214,6 +294,13 @@ def get_transform_ids(workprogress_id=None, request_id=None, workload_id=None, t
     :returns: list of transform ids.
     """
     try:
+        if workprogress_id:
+            query = session.query(models.Workprogress2transform.transform_id)\
+                           .filter(models.Workprogress2transform.workprogress_id == workprogress_id)
+            if transform_id:
+                query = query.filter(models.Workprogress2transform.transform_id == transform_id)
+            return [transform_id for transform_id, in query.all()]
+
         if workload_id:
             query = session.query(models.Req2transform.transform_id)\
                            .join(models.Request, and_(models.Req2transform.request_id == models.Request.request_id,
@@ -226,12 +313,7 @@ def get_transform_ids(workprogress_id=None, request_id=None, workload_id=None, t
         if transform_id:
             query = query.filter(models.Req2transform.transform_id == transform_id)
 
-        tmp = query.all()
-        ret_ids = []
-        if tmp:
-            for t in tmp:
-                ret_ids.append(t[0])
-        return ret_ids
+        return [transform_id for transform_id, in query.all()]
     except sqlalchemy.orm.exc.NoResultFound as error:
         raise exceptions.NoObject('No transforms attached with request id (%s) and transform_id (%s): %s' %
                                   (request_id, transform_id, error))
@@ -267,18 +349,10 @@ def get_transforms(request_id=None, workload_id=None, transform_id=None, to_json
             subquery = subquery.filter(models.Req2transform.transform_id == transform_id)
         subquery = subquery.subquery()
 
-        query = session.query(models.Transform)\
+        query = session.query(models.Transform.__table__)\
                        .join(subquery, and_(subquery.c.transform_id == models.Transform.transform_id))
 
-        tmp = query.all()
-        rets = []
-        if tmp:
-            for t in tmp:
-                if to_json:
-                    rets.append(t.to_dict_json())
-                else:
-                    rets.append(t.to_dict())
-        return rets
+        return [row2dict(t, to_json=to_json) for t in query.all()]
     except sqlalchemy.orm.exc.NoResultFound as error:
         raise exceptions.NoObject('No transforms attached with request id (%s): %s' %
                                   (request_id, error))
@@ -305,32 +379,85 @@ def get_transforms_by_status(status, period=None, locking=False, bulk_size=None,
     try:
         if not isinstance(status, (list, tuple)):
             status = [status]
-        if len(status) == 1:
-            status = [status[0], status[0]]
 
-        query = session.query(models.Transform)\
-                       .filter(models.Transform.status.in_(status))\
-                       .filter(models.Transform.next_poll_at < datetime.datetime.utcnow())
+        query = bakery(lambda session: session.query(models.Transform.__table__))
+        query += lambda q: q.filter(models.Transform.status.in_(bindparam('status', expanding=True)))\
+                            .filter(models.Transform.next_poll_at < models.utcnow())
+        params = {'status': status}
 
         if period:
-            query = query.filter(models.Transform.updated_at < datetime.datetime.utcnow() - datetime.timedelta(seconds=period))
+            query += lambda q: q.filter(models.Transform.updated_at < models.utcnow(bindparam('period_offset')))
+            params['period_offset'] = -period
         if locking:
-            query = query.filter(models.Transform.locking == TransformLocking.Idle)
+            query += lambda q: q.filter(models.Transform.locking == TransformLocking.Idle)
 
+        query += lambda q: q.order_by(asc(models.Transform.updated_at)).order_by(desc(models.Transform.priority))
+
+        if bulk_size:
+            query += lambda q: q.limit(bindparam('bulk_size'))
+            params['bulk_size'] = bulk_size
+
+        result = query(get_baked_session(session)).params(**params).with_post_criteria(lambda q: q.yield_per(1000))
+        return [row2dict(t, to_json=to_json) for t in result]
+    except sqlalchemy.orm.exc.NoResultFound as error:
+        raise exceptions.NoObject('No transforms attached with status (%s): %s' %
+                                  (status, error))
+    except Exception as error:
+        raise error
+
+
+@transactional_session
+def claim_transforms_by_status(status, period=None, bulk_size=None, to_json=False, session=None):
+    """
+    Get unlocked transforms with the status and lock them in the same transaction.
+    Rows which are locked by another transaction are skipped, so that several agents can claim transforms concurrently.
+
+    :param status: Transform status or list of transform status.
+    :param period: Time period in seconds.
+    :param bulk_size: bulk size limitation.
+    :param to_json: return json format.
+
+    :param session: The database session in use.
+
+    :raises NoObject: If no transform is founded.
+
+    :returns: list of transform.
+    """
+    try:
+        if not isinstance(status, (list, tuple)):
+            status = [status]
+
+        # the filters are applied again when the candidates are locked, as they may be claimed,
+        # polled and released by another agent in between.
+        filters = [models.Transform.status.in_(status),
+                   models.Transform.next_poll_at < models.utcnow(),
+                   models.Transform.locking == TransformLocking.Idle]
+        if period:
+            filters.append(models.Transform.updated_at < models.utcnow(-period))
+
+        query = session.query(models.Transform.transform_id).filter(*filters)
         query = query.order_by(asc(models.Transform.updated_at)).order_by(desc(models.Transform.priority))
 
         if bulk_size:
             query = query.limit(bulk_size)
-
-        tmp = query.all()
-        rets = []
-        if tmp:
-            for t in tmp:
-                if to_json:
-                    rets.append(t.to_dict_json())
-                else:
-                    rets.append(t.to_dict())
-        return rets
+        transform_ids = [transform_id for transform_id, in query.all()]
+        if not transform_ids:
+            return []
+
+        # 'FOR UPDATE' cannot be combined with the ordered and limited query on Oracle,
+        # so the candidates are locked by their primary keys.
+        query = session.query(models.Transform.__table__)\
+                       .filter(models.Transform.transform_id.in_(transform_ids))\
+                       .filter(*filters)\
+                       .with_for_update(skip_locked=True)
+        transforms = [row2dict(t, to_json=to_json) for t in query.all()]
+        if transforms:
+            session.query(models.Transform)\
+                   .filter(models.Transform.transform_id.in_([t['transform_id'] for t in transforms]))\
+                   .update({'locking': TransformLocking.Locking, 'updated_at': models.utcnow()}, synchronize_session=False)
+        for transform in transforms:
+            transform['locking'] = TransformLocking.Locking
+        return transforms
     except sqlalchemy.orm.exc.NoResultFound as error:
         raise exceptions.NoObject('No transforms attached with status (%s): %s' %
                                   (status, error))
@@ -339,26 +466,49 @@ def get_transforms_by_status(status, period=None, locking=False, bulk_size=None,
 
 
 @transactional_session
-def update_transform(transform_id, parameters, session=None):
+def update_transform(transform_id, parameters, return_updated=False, session=None):
     """
     update a transform.
 
     :param transform_id: the transform id.
     :param parameters: A dictionary of parameters.
+    :param return_updated: Whether to return the updated transform.
+                           Backends without UPDATE ... RETURNING need one more query to read it.
     :param session: The database session in use.
 
     :raises NoObject: If no content is founded.
     :raises DatabaseException: If there is a database error.
 
+    :returns: The updated transform if return_updated is set, otherwise None.
     """
     try:
-        parameters['updated_at'] = datetime.datetime.utcnow()
+        # the times are set by the database clock, which clean_locking and the polls compare against.
+        parameters['updated_at'] = models.utcnow()
         if 'status' in parameters and parameters['status'] in [TransformStatus.Finished, TransformStatus.Finished.value,
                                                                TransformStatus.Failed, TransformStatus.Failed.value]:
-            parameters['finished_at'] = datetime.datetime.utcnow()
+            parameters['finished_at'] = models.utcnow()
+
+        stmt = models.Transform.__table__.update()\
+                                         .where(models.Transform.transform_id == transform_id)\
+                                         .values(**parameters)
+        ret = None
+        if return_updated and session.bind.dialect.name == 'postgresql':
+            ret = session.execute(stmt.returning(*models.Transform.__table__.columns)).first()
+        else:
+            session.execute(stmt)
+            if return_updated:
+                ret = session.query(models.Transform.__table__)\
+                             .filter(models.Transform.transform_id == transform_id)\
+                             .first()
+
+        # the transform in the session identity map, if any, is reloaded at the next access.
+        transform = session.identity_map.get(identity_key(models.Transform, transform_id))
+        if transform is not None:
+            session.expire(transform)
 
-        session.query(models.Transform).filter_by(transform_id=transform_id)\
-               .update(parameters, synchronize_session=False)
+        if not ret:
+            return None
+        return row2dict(ret)
     except sqlalchemy.orm.exc.NoResultFound as error:
         raise exceptions.NoObject('Transfrom %s cannot be found: %s' % (transform_id, error))
 
@@ -376,37 +526,85 @@ def delete_transform(transform_id=None, session=None):
     """
     try:
         session.query(models.Req2transform).filter_by(transform_id=transform_id).delete()
+        session.query(models.Workprogress2transform).filter_by(transform_id=transform_id).delete()
         session.query(models.Transform).filter_by(transform_id=transform_id).delete()
     except sqlalchemy.orm.exc.NoResultFound as error:
         raise exceptions.NoObject('Transfrom %s cannot be found: %s' % (transform_id, error))
 
 
+def update_transforms_in_chunks(filters, params, chunk_size=1000, session=None):
+    """
+    Update the transforms matching the filters in chunks, which are committed one by one.
+    The candidates of a chunk are selected without locking and then locked by their primary keys,
+    skipping the rows locked by others. On Oracle ROWNUM is counted before locked rows are skipped,
+    so a limited 'FOR UPDATE SKIP LOCKED' query can return nothing while unlocked candidates remain.
+
+    :param filters: list of filter criteria of the transforms.
+    :param params: A dictionary of parameters to update.
+    :param chunk_size: The number of transforms updated in one chunk. The ids of a chunk are passed in one
+                       'IN' list, which Oracle limits to 1000 items, so it's capped at 1000.
+    :param session: The database session in use.
+
+    :returns: The number of updated transforms.
+    """
+    chunk_size = min(chunk_size, 1000)
+    num_updated = 0
+    last_transform_id = None
+    while True:
+        query = session.query(models.Transform.transform_id).filter(*filters)
+        if last_transform_id is not None:
+            query = query.filter(models.Transform.transform_id > last_transform_id)
+        query = query.order_by(asc(models.Transform.transform_id)).limit(chunk_size)
+        transform_ids = [transform_id for transform_id, in query.all()]
+        if not transform_ids:
+            break
+        last_transform_id = transform_ids[-1]
+
+        query = session.query(models.Transform.transform_id)\
+                       .filter(models.Transform.transform_id.in_(transform_ids))\
+                       .filter(*filters)\
+                       .with_for_update(skip_locked=True)
+        transform_ids = [transform_id for transform_id, in query.all()]
+        if transform_ids:
+            num_updated += session.query(models.Transform).filter(models.Transform.transform_id.in_(transform_ids))\
+                                  .update(params, synchronize_session=False)
+        session.commit()
+    return num_updated
+
+
 @transactional_session
-def clean_locking(time_period=3600, session=None):
+def clean_locking(time_period=3600, chunk_size=1000, session=None):
     """
     Clearn locking which is older than time period.
+    The transforms are updated in chunks, which are committed one by one, and rows locked by others are skipped.
 
     :param time_period in seconds
+    :param chunk_size: The number of transforms updated in one chunk, at most 1000.
+
+    :returns: The number of updated transforms.
     """
 
-    params = {'locking': 0}
-    session.query(models.Transform).filter(models.Transform.locking == TransformLocking.Locking)\
-           .filter(models.Transform.updated_at < datetime.datetime.utcnow() - datetime.timedelta(seconds=time_period))\
-           .update(params, synchronize_session=False)
+    params = {'locking': TransformLocking.Idle, 'updated_at': models.utcnow()}
+    filters = [models.Transform.locking == TransformLocking.Locking,
+               models.Transform.updated_at < models.utcnow(-time_period)]
+    return update_transforms_in_chunks(filters, params, chunk_size=chunk_size, session=session)
 
 
 @transactional_session
-def clean_next_poll_at(status, session=None):
+def clean_next_poll_at(status, chunk_size=1000, session=None):
     """
     Clearn next_poll_at.
+    The transforms are updated in chunks, which are committed one by one, and rows locked by others are skipped.
 
     :param status: status of the transform
+    :param chunk_size: The number of transforms updated in one chunk, at most 1000.
+
+    :returns: The number of updated transforms.
     """
     if not isinstance(status, (list, tuple)):
         status = [status]
-    if len(status) == 1:
-        status = [status[0], status[0]]
 
-    params = {'next_poll_at': datetime.datetime.utcnow()}
-    session.query(models.Transform).filter(models.Transform.status.in_(status))\
-           .update(params, synchronize_session=False)
+    params = {'next_poll_at': models.utcnow(), 'updated_at': models.utcnow()}
+    filters = [models.Transform.status.in_(status),
+               models.Transform.next_poll_at > models.utcnow()]
+    return update_transforms_in_chunks(filters, params, chunk_size=chunk_size, session=session)
@@ -43,7 +43,7 @@ def create_workprogress(request_id, scope, name, priority=0, status=Workprogress
 
     :returns: workprogress.
     """
-    new_wp = models.WorkProgress(request_id=request_id, scope=scope, name=name, priority=priority, status=status,
+    new_wp = models.Workprogress(request_id=request_id, scope=scope, name=name, priority=priority, status=status,
                                  locking=locking, expired_at=expired_at,
                                  workprogress_metadata=workprogress_metadata,
                                  processing_metadata=processing_metadata)
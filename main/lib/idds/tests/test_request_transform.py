@@ -20,7 +20,9 @@ from nose.tools import assert_equal
 
 from idds.common.utils import check_database, has_config, setup_logging
 from idds.orm.requests import (add_request, get_request, delete_requests)
-from idds.orm.transforms import (add_transform, get_transform, get_transform_ids, delete_transform)
+from idds.orm.workprogress import add_workprogress, delete_workprogress
+from idds.orm.transforms import (add_transform, add_transforms, add_req2transforms, get_transform,
+                                 get_transform_ids, delete_transform)
 from idds.tests.common import get_request_properties, get_transform_properties
 
 setup_logging(__name__)
@@ -68,3 +70,52 @@ class TestTransform(unittest.TestCase):
 
         trans = get_transform(transform_id=trans_id)
         assert_equal(trans, None)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_create_and_check_for_request_transforms_bulk_orm(self):
+        """ Transform (ORM): Test to create Transforms in bulk """
+        req_properties = get_request_properties()
+        req_properties['workload_id'] = int(time.time()) + random.randint(1, 1000000)
+        request_id = add_request(**req_properties)
+
+        trans_properties = [get_transform_properties() for _ in range(3)]
+        trans_ids = add_transforms(trans_properties, bulk_size=2)
+        assert_equal(len(trans_ids), len(trans_properties))
+        for trans_id, trans_property in zip(trans_ids, trans_properties):
+            transform = get_transform(transform_id=trans_id)
+            for key in trans_property:
+                assert_equal(transform[key], trans_property[key])
+
+        add_req2transforms([{'request_id': request_id, 'transform_id': trans_id} for trans_id in trans_ids])
+        assert_equal(sorted(get_transform_ids(request_id=request_id)), sorted(trans_ids))
+
+        for trans_id in trans_ids:
+            delete_transform(trans_id)
+        delete_requests(request_id=request_id)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_create_and_check_for_workprogress_transforms_bulk_orm(self):
+        """ Transform (ORM): Test to create Transforms of a Workprogress in bulk """
+        req_properties = get_request_properties()
+        req_properties['workload_id'] = int(time.time()) + random.randint(1, 1000000)
+        request_id = add_request(**req_properties)
+        workprogress_id = add_workprogress(request_id=request_id, scope=req_properties['scope'],
+                                           name=req_properties['name'])
+
+        trans_properties = [get_transform_properties() for _ in range(3)]
+        for trans_property in trans_properties:
+            trans_property['workprogress_id'] = workprogress_id
+        trans_ids = add_transforms(trans_properties, bulk_size=2)
+        assert_equal(len(set(trans_ids)), len(trans_properties))
+        for trans_id, trans_property in zip(trans_ids, trans_properties):
+            transform = get_transform(transform_id=trans_id)
+            assert_equal(transform['transform_id'], trans_id)
+            assert_equal(transform['transform_tag'], trans_property['transform_tag'])
+        assert_equal(sorted(get_transform_ids(workprogress_id=workprogress_id)), sorted(trans_ids))
+
+        for trans_id in trans_ids:
+            delete_transform(trans_id)
+        delete_workprogress(workprogress_id)
+        delete_requests(request_id=request_id)
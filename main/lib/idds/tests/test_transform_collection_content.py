@@ -49,7 +49,8 @@ class TestTransformCollectionContent(unittest.TestCase):
         for key in trans_properties:
             assert_equal(transform[key], trans_properties[key])
 
-        update_transform(trans_id, {'status': TransformStatus.Failed})
+        transform = update_transform(trans_id, {'status': TransformStatus.Failed}, return_updated=True)
+        assert_equal(transform['status'], TransformStatus.Failed)
         transform = get_transform(transform_id=trans_id)
         assert_equal(transform['status'], TransformStatus.Failed)
 
@@ -13,14 +13,20 @@
 Test Request.
 """
 
+import datetime
+import time
+
 import unittest2 as unittest
 from nose.tools import assert_equal
 
 from idds.common.utils import check_database, has_config, setup_logging
-from idds.common.constants import ProcessingStatus
-from idds.orm.transforms import add_transform, delete_transform
-from idds.orm.processings import (add_processing, update_processing,
-                                  get_processing, delete_processing)
+from idds.common.constants import ProcessingStatus, ProcessingLocking, TransformStatus, TransformLocking
+from idds.orm.transforms import (add_transform, delete_transform, update_transform, get_transform,
+                                 claim_transforms_by_status, clean_locking as clean_transform_locking,
+                                 clean_next_poll_at as clean_transform_next_poll_at)
+from idds.orm.processings import (add_processing, update_processing, update_processings,
+                                  get_processing, delete_processing, claim_processings_by_status,
+                                  clean_locking as clean_processing_locking)
 from idds.tests.common import get_transform_properties, get_processing_properties
 
 setup_logging(__name__)
@@ -48,9 +54,95 @@ class TestTransformProcessing(unittest.TestCase):
         processing = get_processing(processing_id=processing_id)
         assert_equal(processing['status'], ProcessingStatus.Failed)
 
+        update_processings([{'processing_id': processing_id, 'status': ProcessingStatus.Finished}])
+        processing = get_processing(processing_id=processing_id)
+        assert_equal(processing['status'], ProcessingStatus.Finished)
+
         delete_processing(processing_id)
 
         processing = get_processing(processing_id=processing_id)
         assert_equal(processing, None)
 
         delete_transform(trans_id)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_claim_and_clean_transforms_orm(self):
+        """ Transform (ORM): Test claiming transforms and cleaning their locking and next_poll_at """
+        trans_properties = get_transform_properties()
+        trans_properties['status'] = TransformStatus.Extend
+        trans_ids = [add_transform(**trans_properties) for _ in range(3)]
+        for trans_id in trans_ids:
+            update_transform(trans_id, {'next_poll_at': datetime.datetime.utcnow() - datetime.timedelta(seconds=60)})
+
+        transforms = [t for t in claim_transforms_by_status(TransformStatus.Extend) if t['transform_id'] in trans_ids]
+        assert_equal(sorted([t['transform_id'] for t in transforms]), sorted(trans_ids))
+        for transform in transforms:
+            assert_equal(transform['locking'], TransformLocking.Locking)
+        for trans_id in trans_ids:
+            assert_equal(get_transform(trans_id)['locking'], TransformLocking.Locking)
+
+        # locked transforms are not claimed again.
+        transforms = [t for t in claim_transforms_by_status(TransformStatus.Extend) if t['transform_id'] in trans_ids]
+        assert_equal(transforms, [])
+
+        time.sleep(1)
+        claimed_at = {trans_id: get_transform(trans_id)['updated_at'] for trans_id in trans_ids}
+        assert_equal(clean_transform_locking(time_period=0, chunk_size=2) >= len(trans_ids), True)
+        for trans_id in trans_ids:
+            transform = get_transform(trans_id)
+            assert_equal(transform['locking'], TransformLocking.Idle)
+            assert_equal(transform['updated_at'] > claimed_at[trans_id], True)
+
+        for trans_id in trans_ids:
+            update_transform(trans_id, {'next_poll_at': datetime.datetime.utcnow() + datetime.timedelta(seconds=3600)})
+        transforms = [t for t in claim_transforms_by_status(TransformStatus.Extend) if t['transform_id'] in trans_ids]
+        assert_equal(transforms, [])
+
+        updated_at = {trans_id: get_transform(trans_id)['updated_at'] for trans_id in trans_ids}
+        time.sleep(1)
+        clean_transform_next_poll_at(TransformStatus.Extend, chunk_size=2)
+        for trans_id in trans_ids:
+            transform = get_transform(trans_id)
+            assert_equal(transform['updated_at'] > updated_at[trans_id], True)
+            # both times are set by the same database clock in one statement.
+            assert_equal(transform['updated_at'], transform['next_poll_at'])
+        time.sleep(1)
+        transforms = [t for t in claim_transforms_by_status(TransformStatus.Extend) if t['transform_id'] in trans_ids]
+        assert_equal(sorted([t['transform_id'] for t in transforms]), sorted(trans_ids))
+
+        for trans_id in trans_ids:
+            delete_transform(trans_id)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_claim_and_clean_processings_orm(self):
+        """ Processing (ORM): Test claiming processings and cleaning their locking """
+        trans_id = add_transform(**get_transform_properties())
+        proc_properties = get_processing_properties()
+        proc_properties['transform_id'] = trans_id
+        proc_properties['status'] = ProcessingStatus.TimeOut
+        processing_ids = [add_processing(**proc_properties) for _ in range(3)]
+        update_processings([{'processing_id': processing_id,
+                             'next_poll_at': datetime.datetime.utcnow() - datetime.timedelta(seconds=60)}
+                            for processing_id in processing_ids])
+
+        processings = [p for p in claim_processings_by_status(ProcessingStatus.TimeOut) if p['processing_id'] in processing_ids]
+        assert_equal(sorted([p['processing_id'] for p in processings]), sorted(processing_ids))
+        for processing in processings:
+            assert_equal(processing['locking'], ProcessingLocking.Locking)
+        for processing_id in processing_ids:
+            assert_equal(get_processing(processing_id)['locking'], ProcessingLocking.Locking)
+
+        # locked processings are not claimed again.
+        processings = [p for p in claim_processings_by_status(ProcessingStatus.TimeOut) if p['processing_id'] in processing_ids]
+        assert_equal(processings, [])
+
+        time.sleep(1)
+        clean_processing_locking(time_period=0)
+        processings = [p for p in claim_processings_by_status(ProcessingStatus.TimeOut) if p['processing_id'] in processing_ids]
+        assert_equal(sorted([p['processing_id'] for p in processings]), sorted(processing_ids))
+
+        for processing_id in processing_ids:
+            delete_processing(processing_id)
+        delete_transform(trans_id)